@@ -4,21 +4,32 @@ import time
 import uuid
 import json
 import queue
+import importlib
 import random
+import shutil
 import threading
 import subprocess
+from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
-from functools import lru_cache
 from typing import Dict, Optional, List, Any, Generator
 
-from PIL import Image
-from PIL.PngImagePlugin import PngInfo
-
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
+from http_cache import CachedFile, CompressionMiddleware, ImmutableStaticFiles, cached_json_response, make_etag
+from output_store import (
+    STATE_DIR_NAME,
+    allocate_output,
+    commit_output,
+    discard_output,
+    folder_generation,
+    iter_png_files,
+    resolve_output_file,
+    to_relpath,
+)
+
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PARENT_DIR = os.path.dirname(BASE_DIR)
@@ -88,6 +99,10 @@ VAE_PATH = (
     or os.path.join(MODEL_DIR, "ae-Q8_0.gguf")
 )
 OUTPUT_DIR = os.getenv("WINDDRAWER_OUTPUT_DIR") or os.path.join(BASE_DIR, "outputs")
+SD_CLI_PROBE_PATH = os.path.join(OUTPUT_DIR, STATE_DIR_NAME, "sd_cli_probe.json")
+# /api/ready waits for the probe, so a hanging sd-cli must not block startup.
+SD_CLI_PROBE_TIMEOUT_SEC = float(os.getenv("WINDDRAWER_SD_CLI_PROBE_TIMEOUT_SEC") or 5)
+SD_CLI_PROBE_RETRY_SEC = 60.0
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
@@ -97,30 +112,147 @@ def clean_ansi(text: str) -> str:
     return ansi_escape.sub("", text)
 
 
-@lru_cache(maxsize=1)
+_SD_CLI_FLAG_RE = re.compile(r"(?<![\w-])--[a-z0-9][a-z0-9-]*")
+_SD_CLI_VERSION_RE = re.compile(r"version[:\s]+v?([\w.+-]+)", re.IGNORECASE)
+
+
 def _sd_cli_help_text() -> str:
     exe_dir = os.path.dirname(SD_CLI) or None
     try:
         result = subprocess.run(
             [SD_CLI, "--help"],
+            stdin=subprocess.DEVNULL,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             text=True,
             encoding="utf-8",
             errors="replace",
             cwd=exe_dir,
+            timeout=SD_CLI_PROBE_TIMEOUT_SEC,
             check=False,
         )
+    except subprocess.TimeoutExpired:
+        print(f"sd-cli --help did not finish within {SD_CLI_PROBE_TIMEOUT_SEC:g}s; treating sd-cli as unavailable")
+        return ""
     except Exception:
         return ""
     return clean_ansi(result.stdout or "")
 
 
+class SdCliProbe:
+    """sd-cli capabilities (supported flags, version), persisted across restarts.
+
+    The cache is keyed by the binary's path, size and mtime, so rebuilding
+    stable-diffusion.cpp triggers a fresh ``--help`` run on next use.
+    """
+
+    def __init__(self, cache_path: str) -> None:
+        self.cache_path = cache_path
+        self._probe: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+    @staticmethod
+    def _is_current(probe: Optional[Dict[str, Any]], key: Optional[Dict[str, Any]]) -> bool:
+        if probe is None or probe["key"] != key:
+            return False
+        # Failed probes are never persisted; retry them now and then.
+        return probe["available"] or time.time() - probe["probed_at"] < SD_CLI_PROBE_RETRY_SEC
+
+    @staticmethod
+    def _binary_key() -> Optional[Dict[str, Any]]:
+        path = shutil.which(SD_CLI) or SD_CLI
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def _load(self, key: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                probe = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return probe if isinstance(probe, dict) and probe.get("key") == key else None
+
+    def _save(self, probe: Dict[str, Any]) -> None:
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(probe, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as exc:
+            print(f"Error saving sd-cli probe: {exc}")
+
+    def get(self) -> Dict[str, Any]:
+        key = self._binary_key()
+        # One probe at a time: callers arriving during the boot-time refresh
+        # wait for it instead of running sd-cli --help again.
+        with self._lock:
+            if self._is_current(self._probe, key):
+                return self._probe
+
+            probe = self._load(key) if key else None
+            if probe is None:
+                help_text = _sd_cli_help_text() if key else ""
+                version = _SD_CLI_VERSION_RE.search(help_text)
+                probe = {
+                    "key": key,
+                    "available": bool(help_text),
+                    "version": version.group(1) if version else None,
+                    "flags": sorted(set(_SD_CLI_FLAG_RE.findall(help_text))),
+                    "probed_at": time.time(),
+                }
+                if probe["available"]:
+                    self._save(probe)
+            self._probe = probe
+            return probe
+
+    def cached(self) -> Optional[Dict[str, Any]]:
+        """Last probe result without running sd-cli; stale results trigger a background refresh."""
+        probe = self._probe
+        if not self._is_current(probe, self._binary_key()):
+            self.refresh_in_background()
+        return probe
+
+    def refresh_in_background(self) -> None:
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._refresh, name="sd-cli-probe", daemon=True)
+            self._thread.start()
+
+    def _refresh(self) -> None:
+        try:
+            self.get()
+        except Exception as exc:
+            print(f"sd-cli probe failed: {exc}")
+
+    def supports(self, flag: str) -> bool:
+        probe = self.cached()
+        # Only a missing probe or a replaced binary is worth waiting for;
+        # retries of a failed probe happen in the background.
+        if probe is None or probe["key"] != self._binary_key():
+            probe = self.get()
+        return flag in probe["flags"]
+
+
+_sd_cli_probe = SdCliProbe(SD_CLI_PROBE_PATH)
+
+
 def _sd_cli_supports(flag: str) -> bool:
-    return flag in _sd_cli_help_text()
+    return _sd_cli_probe.supports(flag)
 
 
 def write_png_metadata(png_path: str, meta: Dict[str, Any]) -> bool:
+    # PIL is imported lazily (and pre-warmed in the background at boot) to keep
+    # it off the import path.
+    from PIL import Image
+    from PIL.PngImagePlugin import PngInfo
+
     try:
         img = Image.open(png_path)
         pnginfo = PngInfo()
@@ -139,6 +271,8 @@ def write_png_metadata(png_path: str, meta: Dict[str, Any]) -> bool:
 
 
 def read_png_metadata(png_path: str) -> Dict[str, Any]:
+    from PIL import Image
+
     img = Image.open(png_path)
     info: Dict[str, Any] = dict(getattr(img, "info", {}) or {})
 
@@ -210,11 +344,36 @@ class JobCancelled(Exception):
     pass
 
 
-app = FastAPI(title="WindDrawer API")
+_started_at = time.time()
+_startup_done = threading.Event()
+
+
+def _warm_up() -> None:
+    try:
+        _sd_cli_probe.get()
+        # Pay PIL's import cost here rather than in the first render.
+        importlib.import_module("PIL.PngImagePlugin")
+    except Exception as exc:
+        print(f"Startup warm-up failed: {exc}")
+    finally:
+        _startup_done.set()
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    threading.Thread(target=_warm_up, name="startup-warm-up", daemon=True).start()
+    yield
+
+
+app = FastAPI(title="WindDrawer API", lifespan=lifespan)
+app.add_middleware(CompressionMiddleware)
 
 WEB_DIR = os.path.join(BASE_DIR, "web")
 app.mount("/static", StaticFiles(directory=os.path.join(WEB_DIR, "static")), name="static")
-app.mount("/outputs", StaticFiles(directory=OUTPUT_DIR), name="outputs")
+app.mount("/outputs", ImmutableStaticFiles(directory=OUTPUT_DIR), name="outputs")
+
+_index_page = CachedFile(os.path.join(WEB_DIR, "index.html"))
+_metadata_page = CachedFile(os.path.join(WEB_DIR, "metadata.html"))
 
 _jobs: Dict[str, Job] = {}
 _render_lock = threading.Lock()
@@ -222,17 +381,13 @@ _sys_random = random.SystemRandom()
 
 
 @app.get("/", response_class=HTMLResponse)
-def index() -> str:
-    index_path = os.path.join(WEB_DIR, "index.html")
-    with open(index_path, "r", encoding="utf-8") as f:
-        return f.read()
+def index(request: Request) -> Response:
+    return _index_page.response(request)
 
 
 @app.get("/metadata", response_class=HTMLResponse)
-def metadata_page() -> str:
-    page_path = os.path.join(WEB_DIR, "metadata.html")
-    with open(page_path, "r", encoding="utf-8") as f:
-        return f.read()
+def metadata_page(request: Request) -> Response:
+    return _metadata_page.response(request)
 
 
 @app.get("/favicon.ico", include_in_schema=False)
@@ -241,6 +396,23 @@ async def favicon():
     return FileResponse(fav_path)
 
 
+@app.get("/api/ready")
+def api_ready() -> JSONResponse:
+    ready = _startup_done.is_set()
+    body: Dict[str, Any] = {"ready": ready, "uptime_sec": time.time() - _started_at}
+    if ready:
+        # Never probe on the request thread: health checks must answer quickly.
+        probe = _sd_cli_probe.cached() or {"available": False, "version": None, "flags": []}
+        body["sd_cli"] = {
+            "path": SD_CLI,
+            "available": probe["available"],
+            "version": probe["version"],
+            "flags": len(probe["flags"]),
+        }
+        body["models"] = len(list_sd_models())
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+
 @app.get("/api/models")
 def api_models() -> dict:
     return {"models": list_sd_models()}
@@ -262,43 +434,38 @@ def api_aspects() -> dict:
     }
 
 
-@app.get("/api/outputs")
-def api_outputs() -> dict:
+def list_outputs() -> dict:
     items: List[dict] = []
-    out_dir = os.path.abspath(OUTPUT_DIR)
-    try:
-        for name in os.listdir(out_dir):
-            if not name.lower().endswith(".png"):
-                continue
-            path = os.path.join(out_dir, name)
-            try:
-                stat = os.stat(path)
-            except OSError:
-                continue
-            items.append({
-                "filename": name,
-                "url": f"/outputs/{name}",
-                "mtime": stat.st_mtime,
-                "size": stat.st_size,
-            })
-    except OSError:
-        items = []
+    for relpath, entry in iter_png_files(os.path.abspath(OUTPUT_DIR)):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        items.append({
+            "filename": relpath,
+            "url": f"/outputs/{relpath}",
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+        })
 
     items.sort(key=lambda x: x.get("mtime", 0), reverse=True)
     return {"items": items}
 
 
-@app.get("/api/metadata/{filename}")
+@app.get("/api/outputs")
+def api_outputs(request: Request) -> Response:
+    etag = make_etag("outputs", folder_generation(OUTPUT_DIR))
+    return cached_json_response(request, etag, list_outputs)
+
+
+@app.get("/api/metadata/{filename:path}")
 def api_metadata(filename: str) -> dict:
-    safe_name = os.path.basename(filename)
-    if safe_name != filename:
-        raise HTTPException(status_code=400, detail="invalid filename")
+    safe_name = filename.replace("\\", "/")
     if not safe_name.lower().endswith(".png"):
         raise HTTPException(status_code=400, detail="only .png supported")
 
-    path = os.path.abspath(os.path.join(OUTPUT_DIR, safe_name))
-    out_dir = os.path.abspath(OUTPUT_DIR)
-    if not path.startswith(out_dir + os.sep):
+    path = resolve_output_file(OUTPUT_DIR, safe_name)
+    if path is None:
         raise HTTPException(status_code=400, detail="invalid path")
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail="file not found")
@@ -325,8 +492,9 @@ def _run_sd_cli(
     seed: int,
     sd_model_name: str,
 ) -> str:
-    output_file = f"out_{int(time.time())}_{seed}.png"
-    output_path = os.path.join(OUTPUT_DIR, output_file)
+    # sd-cli renders into a hidden partial file that is renamed into place once
+    # metadata is written, so listings never pick up half-written images.
+    _, output_path, partial_path = allocate_output(OUTPUT_DIR, seed)
 
     cmd = [
         SD_CLI,
@@ -357,7 +525,7 @@ def _run_sd_cli(
     ]
     if _sd_cli_supports("--diffusion-fa"):
         cmd.append("--diffusion-fa")
-    cmd.extend(["-o", output_path])
+    cmd.extend(["-o", partial_path])
 
     exe_dir = os.path.dirname(SD_CLI) or None
     start = time.time()
@@ -373,6 +541,7 @@ def _run_sd_cli(
             cwd=exe_dir,
         )
     except FileNotFoundError as exc:
+        discard_output(partial_path)
         raise RuntimeError(f"启动失败：{exc} (SD_CLI={SD_CLI})")
 
     job.current_proc = process
@@ -391,9 +560,11 @@ def _run_sd_cli(
     duration = time.time() - start
 
     if job.stop_event.is_set():
+        discard_output(partial_path)
         raise JobCancelled()
 
-    if process.returncode != 0 or not os.path.exists(output_path):
+    if process.returncode != 0 or not os.path.exists(partial_path):
+        discard_output(partial_path)
         raise RuntimeError("渲染失败，请检查日志")
 
     meta = {
@@ -412,8 +583,9 @@ def _run_sd_cli(
         "duration_sec": duration,
         "timestamp": int(time.time()),
     }
-    if not write_png_metadata(output_path, meta):
+    if not write_png_metadata(partial_path, meta):
         _emit(job, "log", {"line": "[meta] 写入 PNG 元数据失败（不影响渲染结果）"})
+    commit_output(partial_path, output_path, OUTPUT_DIR)
 
     _emit(job, "render_done", {"seed": seed, "duration": duration, "path": output_path})
     return output_path
@@ -479,7 +651,7 @@ def _render_worker(job: Job, payload: dict) -> None:
                 job.done = True
                 return
 
-            filename = os.path.basename(path)
+            filename = to_relpath(OUTPUT_DIR, path)
             _emit(
                 job,
                 "image",
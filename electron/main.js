@@ -184,8 +184,8 @@ async function startBackend(rootDir) {
 }
 
 async function ensureBackendReady() {
-  const drawerHealthUrl = toHealthUrl(DRAWER_URL, "/api/models");
-  const viewerHealthUrl = toHealthUrl(VIEWER_URL, "/api/images");
+  const drawerHealthUrl = toHealthUrl(DRAWER_URL, "/api/ready");
+  const viewerHealthUrl = toHealthUrl(VIEWER_URL, "/api/ready");
   const drawerReady = await isHttpReady(drawerHealthUrl);
   const viewerReady = await isHttpReady(viewerHealthUrl);
   if (drawerReady && viewerReady) {
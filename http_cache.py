@@ -0,0 +1,216 @@
+import os
+import gzip
+import hashlib
+import threading
+from typing import Any, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.exceptions import HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli  # optional: only used when installed
+except ImportError:
+    brotli = None
+
+
+# Rendered outputs get unique names and are never rewritten after the atomic rename.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "text/css",
+    "text/html",
+    "text/plain",
+    "image/svg+xml",
+}
+
+
+def make_etag(*parts: Any, weak: bool = True) -> str:
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"' if weak else f'"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored on both sides.
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in header.split(","))
+
+
+def not_modified_response(etag: str, cache_control: str = REVALIDATE_CACHE_CONTROL) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+def cached_json_response(request: Request, etag: str, build) -> Response:
+    """Return 304 when the client already has ``etag``; otherwise call ``build()`` for the body."""
+    if etag_matches(request, etag):
+        return not_modified_response(etag)
+    return JSONResponse(build(), headers={"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL})
+
+
+def file_response(request: Request, path: str, immutable: bool = False) -> Response:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return Response(status_code=404)
+
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    cache_control = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    if etag_matches(request, etag):
+        return not_modified_response(etag, cache_control)
+    return FileResponse(path, stat_result=stat, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+class CachedFile:
+    """Keeps a small file (HTML page) in memory and reloads it when its stat changes."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        self._body = b""
+        self._etag = ""
+
+    def load(self) -> Optional[Tuple[bytes, str]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if stamp != self._stamp:
+                try:
+                    with open(self.path, "rb") as f:
+                        body = f.read()
+                except OSError:
+                    return None
+                self._body = body
+                self._etag = make_etag(hashlib.sha1(body).hexdigest())
+                self._stamp = stamp
+            return self._body, self._etag
+
+    def response(self, request: Request, missing: Optional[str] = None) -> Response:
+        loaded = self.load()
+        if loaded is None:
+            if missing is None:
+                return HTMLResponse("Not Found", status_code=404)
+            return HTMLResponse(missing)
+
+        body, etag = loaded
+        if etag_matches(request, etag):
+            return not_modified_response(etag)
+        return HTMLResponse(body, headers={"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL})
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles for finished outputs: keeps Starlette's ETag/304 handling, adds long-lived caching.
+
+    Hidden paths (the .winddrawer state dir, .partial.png renders) are mutable
+    or private and are never served.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if any(part.startswith(".") for part in path.replace("\\", "/").split("/")):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(self, *args: Any, **kwargs: Any) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+def _choose_encoding(accept_encoding: str) -> Optional[str]:
+    offered = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        offered.add(name.strip().lower())
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+class CompressionMiddleware:
+    """Brotli/gzip for text-like responses only.
+
+    Unlike Starlette's GZipMiddleware this leaves PNGs, ZIP exports and SSE
+    streams untouched, so they keep streaming without extra CPU work.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = _choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+        passthrough = False
+        body_parts = []
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+                if content_type not in COMPRESSIBLE_TYPES or "content-encoding" in headers:
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            if passthrough or start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body_parts.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(body_parts)
+            headers = MutableHeaders(raw=start_message["headers"])
+            if len(body) >= self.minimum_size:
+                body = compress_body(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+            headers["Content-Length"] = str(len(body))
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
+
@@ -0,0 +1,347 @@
+import os
+import time
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from output_store import iter_png_files
+
+
+HASH_BATCH_SIZE = 64
+HASH_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+# Clustering splits hashes into max_distance + 1 bands: by pigeonhole, any pair
+# within max_distance agrees exactly on at least one band. Once bands would get
+# narrower than MIN_BAND_BITS (or the folder is small), a blocked full scan is cheaper.
+MIN_BAND_BITS = 5
+# Folder clusters are precomputed at this distance after each build; requests
+# only filter the stored pairs, so they may ask for anything up to it.
+CLUSTER_MAX_DISTANCE = 6
+FULL_SCAN_MAX = 4096
+# Rows per block in the full scan; bounds the (rows x n) uint64 temporary.
+FULL_SCAN_CELLS = 1 << 22
+
+_DCT_SIZE = 32
+_DCT_MATRIX = np.cos(
+    np.pi / (2 * _DCT_SIZE) * np.outer(np.arange(_DCT_SIZE), 2 * np.arange(_DCT_SIZE) + 1)
+)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8).ravel()).tobytes(), "big")
+
+
+def dhash(img: Image.Image) -> int:
+    pixels = np.asarray(img.convert("L").resize((9, 8), Image.Resampling.BILINEAR), dtype=np.int16)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(img: Image.Image) -> int:
+    pixels = np.asarray(
+        img.convert("L").resize((_DCT_SIZE, _DCT_SIZE), Image.Resampling.BILINEAR), dtype=np.float64
+    )
+    low = (_DCT_MATRIX @ pixels @ _DCT_MATRIX.T)[:8, :8]
+    # The DC term only tracks overall brightness; leave it out of the median.
+    median = np.median(low.ravel()[1:])
+    return _bits_to_int(low > median)
+
+
+def hash_files(paths: List[str]) -> List[Optional[Tuple[int, int]]]:
+    """Process-pool worker: (phash, dhash) per path, None for unreadable files."""
+    results: List[Optional[Tuple[int, int]]] = []
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                img.draft("L", (256, 256))
+                img.load()
+                results.append((phash(img), dhash(img)))
+        except Exception:
+            results.append(None)
+    return results
+
+
+def hamming(hashes: np.ndarray, value: int) -> np.ndarray:
+    return np.bitwise_count(hashes ^ np.uint64(value)).astype(np.uint8)
+
+
+class PairSet(NamedTuple):
+    """Close pairs among a snapshot's distinct hashes, up to CLUSTER_MAX_DISTANCE."""
+
+    relpaths: np.ndarray
+    inverse: np.ndarray  # relpath index -> distinct-hash index
+    a: np.ndarray
+    b: np.ndarray
+    distances: np.ndarray
+
+
+class SimilarityIndex:
+    """Perceptual hashes for one folder, kept in packed uint64 arrays.
+
+    A sidecar .npz stores hashes keyed by (relpath, mtime_ns, size) so only new
+    or changed PNGs are decoded again. Building runs on a background thread that
+    feeds batches to a process pool; queries use whatever is indexed so far.
+    """
+
+    def __init__(self, folder: str, cache_path: str) -> None:
+        self.folder = folder
+        self.cache_path = cache_path
+        self.relpaths = np.array([], dtype=str)
+        self.phashes = np.array([], dtype=np.uint64)
+        self.dhashes = np.array([], dtype=np.uint64)
+        self.total = 0
+        self.pending = 0
+        self.built_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._generation: Optional[str] = None
+        self._pairs: Dict[str, PairSet] = {}
+        self._clusters_cache: Dict[Tuple[str, int], Tuple[PairSet, List[List[str]]]] = {}
+
+    def _load_cache(self) -> Dict[str, Tuple[int, int, int, int]]:
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as data:
+                return {
+                    str(rel): (int(mtime), int(size), int(ph), int(dh))
+                    for rel, mtime, size, ph, dh in zip(
+                        data["relpaths"], data["mtime_ns"], data["sizes"], data["phash"], data["dhash"]
+                    )
+                }
+        except (OSError, KeyError, ValueError):
+            return {}
+
+    def _save_cache(self, rows: Dict[str, Tuple[int, int, int, int]]) -> None:
+        rels = list(rows)
+        tmp_path = f"{self.cache_path}.tmp.npz"
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            np.savez(
+                tmp_path,
+                relpaths=np.array(rels, dtype=str),
+                mtime_ns=np.array([rows[r][0] for r in rels], dtype=np.int64),
+                sizes=np.array([rows[r][1] for r in rels], dtype=np.int64),
+                phash=np.array([rows[r][2] for r in rels], dtype=np.uint64),
+                dhash=np.array([rows[r][3] for r in rels], dtype=np.uint64),
+            )
+            os.replace(tmp_path, self.cache_path)
+        except OSError as exc:
+            print(f"Error saving hash cache {self.cache_path}: {exc}")
+
+    def _publish(self, rows: Dict[str, Tuple[int, int, int, int]]) -> None:
+        rels = sorted(rows)
+        with self._lock:
+            self.relpaths = np.array(rels, dtype=str)
+            self.phashes = np.array([rows[r][2] for r in rels], dtype=np.uint64)
+            self.dhashes = np.array([rows[r][3] for r in rels], dtype=np.uint64)
+
+    def _build(self) -> None:
+        cached = self._load_cache()
+        current: Dict[str, Tuple[int, int]] = {}
+        for relpath, entry in iter_png_files(self.folder):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            current[relpath] = (stat.st_mtime_ns, stat.st_size)
+
+        rows: Dict[str, Tuple[int, int, int, int]] = {}
+        todo: List[str] = []
+        for relpath, (mtime_ns, size) in current.items():
+            hit = cached.get(relpath)
+            if hit is not None and hit[0] == mtime_ns and hit[1] == size:
+                rows[relpath] = hit
+            else:
+                todo.append(relpath)
+
+        with self._lock:
+            self.total = len(current)
+            self.pending = len(todo)
+        self._publish(rows)
+        if not todo:
+            if len(rows) != len(cached):
+                self._save_cache(rows)
+            return
+
+        batches = [todo[i:i + HASH_BATCH_SIZE] for i in range(0, len(todo), HASH_BATCH_SIZE)]
+        # spawn: the viewer is multi-threaded, and workers only need this module.
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=ctx) as pool:
+            paths = [[os.path.join(self.folder, *rel.split("/")) for rel in batch] for batch in batches]
+            for done, (batch, results) in enumerate(zip(batches, pool.map(hash_files, paths)), start=1):
+                for relpath, result in zip(batch, results):
+                    if result is not None:
+                        mtime_ns, size = current[relpath]
+                        rows[relpath] = (mtime_ns, size, result[0], result[1])
+                with self._lock:
+                    self.pending -= len(batch)
+                if done % 16 == 0:
+                    self._publish(rows)
+                    self._save_cache(rows)
+
+        self._publish(rows)
+        self._save_cache(rows)
+
+    def _run(self) -> None:
+        try:
+            self._build()
+            for kind in ("phash", "dhash"):
+                self.build_pairs(kind)
+        except Exception as exc:
+            print(f"Hash indexing failed for {self.folder}: {exc}")
+        finally:
+            with self._lock:
+                self.built_at = time.time()
+
+    def refresh(self, generation: str) -> None:
+        """Start a background rebuild if the folder changed since the last one."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if generation == self._generation:
+                return
+            self._generation = generation
+            self._thread = threading.Thread(target=self._run, name="hash-index", daemon=True)
+            self._thread.start()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "indexed": int(self.phashes.size),
+                "total": self.total,
+                "pending": self.pending,
+                "indexing": self._thread is not None and self._thread.is_alive(),
+                "built_at": self.built_at,
+            }
+
+    def _snapshot(self, kind: str) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            return self.relpaths, (self.dhashes if kind == "dhash" else self.phashes)
+
+    def similar(self, relpath: str, max_distance: int, limit: int, kind: str = "phash") -> Optional[List[Dict[str, Any]]]:
+        relpaths, hashes = self._snapshot(kind)
+        idx = int(np.searchsorted(relpaths, relpath))
+        if idx >= relpaths.size or relpaths[idx] != relpath:
+            return None
+
+        distances = hamming(hashes, int(hashes[idx]))
+        distances[idx] = 255
+        matches = np.flatnonzero(distances <= max_distance)
+        order = matches[np.argsort(distances[matches], kind="stable")][:limit]
+        return [{"filename": str(relpaths[i]), "distance": int(distances[i])} for i in order]
+
+    def build_pairs(self, kind: str = "phash") -> PairSet:
+        """Find all pairs within CLUSTER_MAX_DISTANCE; runs on the index thread."""
+        relpaths, hashes = self._snapshot(kind)
+        # Identical hashes (flat or re-saved images) share one distinct value,
+        # so the pair search only runs over distinct values.
+        unique, inverse = np.unique(hashes, return_inverse=True)
+        found = list(close_pairs(unique, CLUSTER_MAX_DISTANCE))
+        x = np.concatenate([p[0] for p in found]).astype(np.int64) if found else np.array([], dtype=np.int64)
+        y = np.concatenate([p[1] for p in found]).astype(np.int64) if found else np.array([], dtype=np.int64)
+        # Band search reports a pair once per shared band; keep one copy.
+        n = max(1, unique.size)
+        a, b = np.divmod(np.unique(np.minimum(x, y) * n + np.maximum(x, y)), n)
+        pairs = PairSet(relpaths, inverse, a, b, np.bitwise_count(unique[a] ^ unique[b]).astype(np.uint8))
+        with self._lock:
+            self._pairs[kind] = pairs
+        return pairs
+
+    def clusters(self, max_distance: int, kind: str = "phash") -> Optional[List[List[str]]]:
+        """Groups of near-duplicates, or None until the first build has finished."""
+        if max_distance > CLUSTER_MAX_DISTANCE:
+            raise ValueError(f"max_distance must be at most {CLUSTER_MAX_DISTANCE} for clusters")
+        with self._lock:
+            pairs = self._pairs.get(kind)
+        if pairs is None:
+            return None
+
+        memo_key = (kind, max_distance)
+        cached = self._clusters_cache.get(memo_key)
+        if cached is not None and cached[0] is pairs:
+            return cached[1]
+
+        parent = np.arange(int(pairs.inverse.max()) + 1 if pairs.inverse.size else 0)
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        close = pairs.distances <= max_distance
+        for i, j in zip(pairs.a[close].tolist(), pairs.b[close].tolist()):
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[rj] = ri
+
+        # Flatten the forest with vectorised pointer jumping, then only touch
+        # relpaths that belong to a group of two or more.
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+        roots = parent[pairs.inverse]
+        grouped = np.flatnonzero(np.bincount(roots, minlength=parent.size)[roots] > 1)
+        groups: Dict[int, List[str]] = {}
+        for i, root in zip(grouped.tolist(), roots[grouped].tolist()):
+            groups.setdefault(root, []).append(str(pairs.relpaths[i]))
+        result = [sorted(members) for members in groups.values()]
+        result.sort(key=len, reverse=True)
+        self._clusters_cache[memo_key] = (pairs, result)
+        return result
+
+
+def _band_layout(bands: int) -> List[Tuple[int, int]]:
+    """(shift, width) for ``bands`` contiguous bands covering all 64 bits."""
+    widths = [64 // bands + (1 if i < 64 % bands else 0) for i in range(bands)]
+    shifts = np.cumsum([0] + widths[:-1])
+    return [(int(shift), width) for shift, width in zip(shifts, widths)]
+
+
+def close_pairs(hashes: np.ndarray, max_distance: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Yield index arrays (a, b) covering every pair within ``max_distance`` bits.
+
+    Pairs may repeat across batches; callers must tolerate duplicates.
+    """
+    n = hashes.size
+    bands = max_distance + 1
+    if n <= FULL_SCAN_MAX or 64 // bands < MIN_BAND_BITS:
+        step = max(1, FULL_SCAN_CELLS // n)
+        for start in range(0, n - 1, step):
+            block = hashes[start:start + step]
+            distances = np.bitwise_count(block[:, None] ^ hashes[None, start + 1:])
+            rows, cols = np.nonzero(distances <= max_distance)
+            a = rows + start
+            b = cols + start + 1
+            keep = a < b
+            yield a[keep], b[keep]
+        return
+
+    for shift, width in _band_layout(bands):
+        keys = (hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        sorted_hashes = hashes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        bucket_end = np.repeat(starts + sizes, sizes)
+
+        # Compare each position with the one `offset` places later inside its
+        # bucket, for all buckets at once; finished positions drop out.
+        active = np.flatnonzero(bucket_end - np.arange(n) > 1)
+        offset = 1
+        while active.size:
+            close = np.bitwise_count(sorted_hashes[active] ^ sorted_hashes[active + offset]) <= max_distance
+            if close.any():
+                hits = active[close]
+                yield order[hits], order[hits + offset]
+            offset += 1
+            active = active[active + offset < bucket_end[active]]
+
+
+def cache_key(folder: str) -> str:
+    return hashlib.sha1(os.path.normcase(os.path.abspath(folder)).encode("utf-8")).hexdigest()[:16]
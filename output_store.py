@@ -0,0 +1,262 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import hashlib
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+# "date" -> 2026/03/01/out_....png, "hash" -> 3f/out_....png, "flat" -> out_....png
+OUTPUT_SHARDING = (os.getenv("WINDDRAWER_OUTPUT_SHARDING") or "date").strip().lower()
+STATE_DIR_NAME = ".winddrawer"
+GENERATION_FILE = "generation"
+PARTIAL_SUFFIX = ".partial.png"
+MAX_SHARD_DEPTH = 3
+
+# Only descend into directories that look like shards, so opening an arbitrary
+# folder in the viewer never walks node_modules/ or model trees.
+_SHARD_DIR_RE = re.compile(r"\d{2,4}|[0-9a-f]{2}")
+
+
+def shard_for(name: str, timestamp: float, sharding: str = OUTPUT_SHARDING) -> str:
+    if sharding == "flat":
+        return ""
+    if sharding == "hash":
+        return hashlib.sha1(name.encode("utf-8")).hexdigest()[:2]
+    return time.strftime("%Y/%m/%d", time.localtime(timestamp))
+
+
+def new_output_name(seed: int, timestamp: float) -> str:
+    stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(timestamp))
+    return f"out_{stamp}_{seed}_{uuid.uuid4().hex[:8]}.png"
+
+
+def to_abs_path(output_dir: str, relpath: str) -> str:
+    return os.path.join(output_dir, *relpath.split("/"))
+
+
+def to_relpath(output_dir: str, path: str) -> str:
+    return os.path.relpath(path, output_dir).replace(os.sep, "/")
+
+
+def allocate_output(output_dir: str, seed: int) -> Tuple[str, str, str]:
+    """Reserve a unique output slot; returns (relpath, final_path, partial_path).
+
+    Writers fill ``partial_path`` and publish it with ``commit_output`` so readers
+    never see a half-written PNG.
+    """
+    now = time.time()
+    name = new_output_name(seed, now)
+    shard = shard_for(name, now)
+    relpath = f"{shard}/{name}" if shard else name
+    final_path = to_abs_path(output_dir, relpath)
+    shard_dir = os.path.dirname(final_path)
+    os.makedirs(shard_dir, exist_ok=True)
+    partial_path = os.path.join(shard_dir, "." + name[: -len(".png")] + PARTIAL_SUFFIX)
+    return relpath, final_path, partial_path
+
+
+def commit_output(partial_path: str, final_path: str, output_dir: Optional[str] = None) -> None:
+    os.replace(partial_path, final_path)
+    if output_dir:
+        bump_generation(output_dir)
+
+
+def discard_output(partial_path: str) -> None:
+    try:
+        os.remove(partial_path)
+    except OSError:
+        pass
+
+
+def bump_generation(folder: str) -> None:
+    """Mark ``folder`` as changed so cached listings (ETags) are invalidated.
+
+    The drawer and viewer run as separate processes, so the marker lives on
+    disk; its inode/mtime change on every replace even if writes race.
+    """
+    state_dir = os.path.join(folder, STATE_DIR_NAME)
+    marker = os.path.join(state_dir, GENERATION_FILE)
+    try:
+        os.makedirs(state_dir, exist_ok=True)
+        tmp_path = f"{marker}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(time.time_ns()))
+        os.replace(tmp_path, marker)
+    except OSError:
+        pass
+
+
+def folder_generation(folder: str) -> str:
+    """Cheap token that changes whenever the PNG set under ``folder`` changes."""
+    parts: List[str] = []
+    try:
+        stat = os.stat(os.path.join(folder, STATE_DIR_NAME, GENERATION_FILE))
+        parts.append(f"g{stat.st_ino:x}.{stat.st_mtime_ns:x}")
+    except OSError:
+        pass
+
+    def walk_dirs(path: str, depth: int) -> None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        parts.append(f"{stat.st_mtime_ns:x}")
+        # On POSIX a directory without subdirectories has exactly two links;
+        # skip listing leaf shards, which can hold thousands of PNGs.
+        if depth >= MAX_SHARD_DEPTH or stat.st_nlink == 2:
+            return
+        try:
+            with os.scandir(path) as it:
+                subdirs = sorted(
+                    entry.path for entry in it
+                    if _SHARD_DIR_RE.fullmatch(entry.name) and entry.is_dir()
+                )
+        except OSError:
+            return
+        for subdir in subdirs:
+            walk_dirs(subdir, depth + 1)
+
+    # The marker covers writes we make ourselves (including in-place rewrites,
+    # which leave directory mtimes alone); shard mtimes cover PNGs added or
+    # removed by hand anywhere in the tree.
+    walk_dirs(folder, 0)
+    return "-".join(parts)
+
+
+def iter_png_files(
+    folder: str,
+    max_depth: int = MAX_SHARD_DEPTH,
+    visited_dirs: Optional[List[str]] = None,
+) -> Iterator[Tuple[str, os.DirEntry]]:
+    """Yield (relpath, entry) for every PNG in ``folder`` and its shard directories.
+
+    Directories that were listed are appended to ``visited_dirs`` when given,
+    so callers can later detect changes by comparing their mtimes.
+    """
+
+    def walk(path: str, prefix: str, depth: int) -> Iterator[Tuple[str, os.DirEntry]]:
+        if visited_dirs is not None:
+            visited_dirs.append(path)
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            return
+
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_file():
+                    if entry.name.lower().endswith(".png"):
+                        yield prefix + entry.name, entry
+                elif depth < max_depth and _SHARD_DIR_RE.fullmatch(entry.name) and entry.is_dir():
+                    yield from walk(entry.path, f"{prefix}{entry.name}/", depth + 1)
+            except OSError:
+                continue
+
+    yield from walk(folder, "", 0)
+
+
+def resolve_output_file(folder: str, relpath: str) -> Optional[str]:
+    """Map a client-supplied relpath to a path inside ``folder``, or None if it escapes."""
+    parts = relpath.replace("\\", "/").split("/")
+    if any(part in ("", ".", "..") or part.startswith(".") for part in parts):
+        return None
+
+    base = os.path.abspath(folder)
+    path = os.path.abspath(os.path.join(base, *parts))
+    try:
+        if os.path.commonpath([base, path]) != base:
+            return None
+    except ValueError:
+        return None
+    return path
+
+
+def _remap_state_keys(folder: str, moves: Dict[str, str]) -> None:
+    # The viewer keys views/stars by relpath; keep them attached to moved files.
+    state_path = os.path.join(folder, STATE_DIR_NAME, "retention.json")
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return
+
+    state["views"] = {moves.get(k, k): v for k, v in (state.get("views") or {}).items()}
+    state["starred"] = sorted(moves.get(k, k) for k in state.get("starred") or [])
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, state_path)
+
+
+def migrate_flat_folder(folder: str, sharding: str = OUTPUT_SHARDING, dry_run: bool = False) -> List[Tuple[str, str]]:
+    """Move top-level PNGs of ``folder`` into shard directories; returns (old, new) relpaths."""
+    if sharding == "flat":
+        return []
+
+    try:
+        with os.scandir(folder) as it:
+            entries = [
+                entry for entry in it
+                if not entry.name.startswith(".")
+                and entry.name.lower().endswith(".png")
+                and entry.is_file()
+            ]
+    except OSError:
+        return []
+
+    moves: List[Tuple[str, str]] = []
+    for entry in sorted(entries, key=lambda e: e.name):
+        try:
+            mtime = entry.stat().st_mtime
+        except OSError:
+            continue
+        shard = shard_for(entry.name, mtime, sharding)
+        shard_dir = to_abs_path(folder, shard)
+        stem, ext = os.path.splitext(entry.name)
+        name = entry.name
+        counter = 1
+        while os.path.exists(os.path.join(shard_dir, name)):
+            name = f"{stem}_{counter}{ext}"
+            counter += 1
+
+        if not dry_run:
+            os.makedirs(shard_dir, exist_ok=True)
+            os.replace(entry.path, os.path.join(shard_dir, name))
+        moves.append((entry.name, f"{shard}/{name}"))
+
+    if moves and not dry_run:
+        _remap_state_keys(folder, dict(moves))
+        bump_generation(folder)
+    return moves
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="WindDrawer output storage tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="reshard a flat output folder")
+    migrate.add_argument("folder", help="folder containing flat out_*.png files")
+    migrate.add_argument("--sharding", choices=["date", "hash"], default=OUTPUT_SHARDING if OUTPUT_SHARDING != "flat" else "date")
+    migrate.add_argument("--dry-run", action="store_true", help="print planned moves without touching files")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.folder):
+        print(f"Folder not found: {args.folder}", file=sys.stderr)
+        return 1
+
+    moves = migrate_flat_folder(args.folder, sharding=args.sharding, dry_run=args.dry_run)
+    for old, new in moves:
+        print(f"{old} -> {new}")
+    verb = "Would move" if args.dry_run else "Moved"
+    print(f"{verb} {len(moves)} file(s).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""Measure listing bandwidth and revalidation cost for a synthetic 10k-image gallery.
+
+Usage: python scripts/bench_http_cache.py [--images 10000]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _populate(output_dir: str, count: int) -> None:
+    from output_store import new_output_name, shard_for
+
+    start = time.time() - count * 60
+    for idx in range(count):
+        ts = start + idx * 60
+        name = new_output_name(idx, ts)
+        shard_dir = os.path.join(output_dir, *shard_for(name, ts).split("/"))
+        os.makedirs(shard_dir, exist_ok=True)
+        path = os.path.join(shard_dir, name)
+        with open(path, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n")
+        os.utime(path, (ts, ts))
+
+
+def _get(url: str, headers: dict) -> tuple:
+    request = urllib.request.Request(url, headers=headers)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as resp:
+            body = resp.read()
+            status, resp_headers = resp.status, resp.headers
+    except urllib.error.HTTPError as exc:
+        body, status, resp_headers = exc.read(), exc.code, exc.headers
+    return status, len(body), resp_headers, (time.perf_counter() - started) * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=10000)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory(prefix="winddrawer-bench-")
+    os.environ["WINDDRAWER_OUTPUT_DIR"] = tmp.name
+    sys.path.insert(0, ROOT_DIR)
+    _populate(tmp.name, args.images)
+
+    import uvicorn
+    import viewer_app
+    from http_cache import brotli
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(viewer_app.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    url = f"http://127.0.0.1:{port}/api/images"
+    encodings = [("identity", "identity"), ("gzip", "gzip")]
+    if brotli is not None:
+        encodings.append(("br", "br"))
+
+    print(f"/api/images with {args.images} images")
+    baseline = None
+    etag = None
+    for label, accept in encodings:
+        status, size, headers, ms = _get(url, {"Accept-Encoding": accept})
+        etag = headers.get("ETag")
+        baseline = baseline or size
+        print(f"  {label:<9} status={status} bytes={size:>9} ({size / baseline:6.1%})  {ms:7.1f} ms")
+
+    status, size, _, ms = _get(url, {"Accept-Encoding": "gzip", "If-None-Match": etag})
+    print(f"  {'304':<9} status={status} bytes={size:>9} ({size / baseline:6.1%})  {ms:7.1f} ms")
+
+    server.should_exit = True
+    thread.join(timeout=5)
+    tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""Time near-duplicate queries on a synthetic hash index and check their recall.
+
+Usage: python scripts/bench_similarity.py [--images 100000] [--max-distance 6]
+
+Planted pairs differ by 0..max_distance bits (evenly spread), so recall below
+100% for either query means pairs within range were missed. Folder clusters
+are timed in two parts: the pair search the index thread runs after each
+build, and the per-request grouping.
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=100000)
+    parser.add_argument("--pairs", type=int, default=2000, help="planted near-duplicate pairs")
+    parser.add_argument("--max-distance", type=int, default=6)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT_DIR)
+    from image_hash import CLUSTER_MAX_DISTANCE, SimilarityIndex
+
+    if args.max_distance > CLUSTER_MAX_DISTANCE:
+        parser.error(f"--max-distance must be at most {CLUSTER_MAX_DISTANCE}")
+
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(0, 2**64, size=args.images, dtype=np.uint64)
+    slots = rng.permutation(args.images)[: 2 * args.pairs].reshape(-1, 2)
+    distances = np.arange(len(slots)) % (args.max_distance + 1)
+    for (src, dst), distance in zip(slots, distances):
+        value = int(hashes[src])
+        for bit in rng.choice(64, size=int(distance), replace=False):
+            value ^= 1 << int(bit)
+        hashes[dst] = np.uint64(value)
+
+    index = SimilarityIndex(ROOT_DIR, os.devnull)
+    index.relpaths = np.array([f"{i:06d}.png" for i in range(args.images)], dtype=str)
+    index.phashes = hashes
+
+    started = time.perf_counter()
+    found_similar = 0
+    for src, dst in slots:
+        matches = index.similar(f"{src:06d}.png", max_distance=args.max_distance, limit=1000)
+        found_similar += any(m["filename"] == f"{dst:06d}.png" for m in matches)
+    similar_ms = (time.perf_counter() - started) * 1000 / len(slots)
+
+    started = time.perf_counter()
+    index.build_pairs()
+    pairs_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    clusters = index.clusters(max_distance=args.max_distance)
+    clusters_ms = (time.perf_counter() - started) * 1000
+    cluster_of = {name: i for i, members in enumerate(clusters) for name in members}
+    found_clusters = sum(
+        cluster_of.get(f"{src:06d}.png", -1) == cluster_of.get(f"{dst:06d}.png", -2)
+        for src, dst in slots
+    )
+
+    print(f"{args.images} hashes, {len(slots)} pairs planted at 0..{args.max_distance} bits")
+    print(f"  similar(one image)  {similar_ms:8.1f} ms (mean)  recall {found_similar / len(slots):6.1%}")
+    print(f"  build_pairs (index) {pairs_ms:8.1f} ms (background, once per build)")
+    print(f"  clusters(folder)    {clusters_ms:8.1f} ms, {len(clusters)} clusters  recall {found_clusters / len(slots):6.1%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Measure drawer cold start: module import time and time to first request.
+
+Usage: python scripts/bench_startup.py [--runs 5] [--sd-cli PATH]
+
+Each run starts a fresh interpreter with an empty output directory, so the
+sd-cli probe cache starts cold unless --warm-probe is given.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import tempfile
+import urllib.error
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=2) as resp:
+            return resp.status
+    except urllib.error.HTTPError as exc:
+        return exc.code
+    except OSError:
+        return 0
+
+
+def measure_import(env: dict) -> float:
+    code = "import time; t = time.perf_counter(); import app_fastapi; print(time.perf_counter() - t)"
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT_DIR, env=env, text=True)
+    return float(out.strip().splitlines()[-1]) * 1000
+
+
+def measure_first_request(env: dict, ready_path: str) -> dict:
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app_fastapi:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT_DIR,
+        env=env,
+    )
+    result = {}
+    try:
+        deadline = started + 60
+        while time.perf_counter() < deadline:
+            if "first_request" not in result and _status(f"{base}/") == 200:
+                result["first_request"] = (time.perf_counter() - started) * 1000
+            if ready_path and _status(f"{base}{ready_path}") == 200:
+                result["ready"] = (time.perf_counter() - started) * 1000
+            if "first_request" in result and ("ready" in result or not ready_path):
+                break
+            time.sleep(0.01)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--sd-cli", default=os.getenv("WINDDRAWER_SD_CLI", ""))
+    parser.add_argument("--ready-path", default="/api/ready", help="empty string to skip")
+    parser.add_argument("--warm-probe", action="store_true", help="reuse one output dir so the probe cache is warm")
+    args = parser.parse_args()
+
+    imports, firsts, readies = [], [], []
+    shared_dir = tempfile.mkdtemp(prefix="winddrawer-bench-") if args.warm_probe else None
+    for _ in range(args.runs):
+        env = dict(os.environ)
+        env["WINDDRAWER_OUTPUT_DIR"] = shared_dir or tempfile.mkdtemp(prefix="winddrawer-bench-")
+        if args.sd_cli:
+            env["WINDDRAWER_SD_CLI"] = args.sd_cli
+        imports.append(measure_import(env))
+        timing = measure_first_request(env, args.ready_path)
+        firsts.append(timing.get("first_request", float("nan")))
+        if "ready" in timing:
+            readies.append(timing["ready"])
+
+    summary = {
+        "import_ms": round(statistics.median(imports), 1),
+        "first_request_ms": round(statistics.median(firsts), 1),
+    }
+    if readies:
+        summary["ready_ms"] = round(statistics.median(readies), 1)
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -102,8 +102,8 @@ $defaultViewerUrl = "http://127.0.0.1:17866/"
 $drawerUrl = Normalize-Url -Value $env:WINDDRAWER_DRAWER_URL -Fallback $defaultDrawerUrl
 $viewerUrl = Normalize-Url -Value $env:WINDDRAWER_VIEWER_URL -Fallback $defaultViewerUrl
 
-$drawerHealthUrl = "$($drawerUrl.TrimEnd('/'))/api/models"
-$viewerHealthUrl = "$($viewerUrl.TrimEnd('/'))/api/images"
+$drawerHealthUrl = "$($drawerUrl.TrimEnd('/'))/api/ready"
+$viewerHealthUrl = "$($viewerUrl.TrimEnd('/'))/api/ready"
 
 $drawerReady = Is-UrlReady -Url $drawerHealthUrl
 $viewerReady = Is-UrlReady -Url $viewerHealthUrl
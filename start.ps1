@@ -247,8 +247,8 @@ $MainUrl = "http://127.0.0.1:17865"
 $ViewerUrl = "http://127.0.0.1:17866"
 Write-Host "[检测] 正在等待服务就绪..." -ForegroundColor Gray
 
-$DrawerReady = Wait-HttpReady -Url "$MainUrl/api/models" -TimeoutSec 120
-$ViewerReady = Wait-HttpReady -Url "$ViewerUrl/api/images" -TimeoutSec 120
+$DrawerReady = Wait-HttpReady -Url "$MainUrl/api/ready" -TimeoutSec 120
+$ViewerReady = Wait-HttpReady -Url "$ViewerUrl/api/ready" -TimeoutSec 120
 
 if ($DrawerReady -and $ViewerReady) {
     Write-Host "[成功] 服务已就绪:" -ForegroundColor Green
@@ -142,8 +142,8 @@ DRAWER_URL="http://127.0.0.1:17865"
 VIEWER_URL="http://127.0.0.1:17866"
 echo "[Wait] Waiting for services..."
 
-wait_http_ready "$DRAWER_URL/api/models" 120
-wait_http_ready "$VIEWER_URL/api/images" 120
+wait_http_ready "$DRAWER_URL/api/ready" 120
+wait_http_ready "$VIEWER_URL/api/ready" 120
 
 echo "[OK] WindDrawer is ready:"
 echo "  Drawer: $DRAWER_URL"
@@ -1,12 +1,36 @@
 import os
 import json
+import time
+import shutil
+import zipfile
+import threading
 import uvicorn
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
 from urllib.parse import quote
-from fastapi import Body, FastAPI, HTTPException, Query
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import Body, FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from PIL import Image
-from typing import Dict, Any, Optional, List, Tuple, Set
+from typing import Dict, Any, Iterator, Optional, List, Tuple, Set
+
+from http_cache import (
+    CachedFile,
+    CompressionMiddleware,
+    ImmutableStaticFiles,
+    cached_json_response,
+    file_response,
+    make_etag,
+)
+from image_hash import CLUSTER_MAX_DISTANCE, SimilarityIndex, cache_key
+from output_store import (
+    STATE_DIR_NAME,
+    bump_generation,
+    folder_generation,
+    iter_png_files,
+    resolve_output_file,
+    to_abs_path,
+)
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,9 +38,30 @@ OUTPUT_DIR = os.getenv("WINDDRAWER_OUTPUT_DIR") or os.path.join(BASE_DIR, "outpu
 WEB_DIR = os.path.join(BASE_DIR, "web")
 DEFAULT_FOLDER_KEY = "__default__"
 PINNED_FOLDERS = {"outputs"}
-CUSTOM_FOLDERS: Set[str] = set()
+EXPORT_CHUNK_SIZE = 1024 * 1024
+# Already-deflated formats are stored as-is; recompressing them only burns CPU.
+EXPORT_STORED_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp")
+RETENTION_STATE_PATH = os.path.join(OUTPUT_DIR, STATE_DIR_NAME, "retention.json")
+RETENTION_GRACE_SEC = 600
+RETENTION_ACTIONS = ("delete", "archive")
+FOLDERS_STATE_PATH = os.path.join(OUTPUT_DIR, STATE_DIR_NAME, "folders.json")
+HASH_CACHE_DIR = os.path.join(OUTPUT_DIR, STATE_DIR_NAME, "hashes")
+SIMILAR_MAX_DISTANCE = 8
+SIMILARITY_INDEX_ENABLED = (os.getenv("WINDDRAWER_SIMILARITY_INDEX") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    retention.start()
+    refresh_similarity_index(OUTPUT_DIR)
+    try:
+        yield
+    finally:
+        retention.stop()
+
 
-app = FastAPI(title="WindDrawer Viewer")
+app = FastAPI(title="WindDrawer Viewer", lifespan=lifespan)
+app.add_middleware(CompressionMiddleware)
 
 # Ensure output directory exists (though this viewer expects to read from it)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -42,19 +87,16 @@ def resolve_folder_path(folder: Optional[str]) -> Tuple[str, str]:
         raise HTTPException(status_code=404, detail="Folder not found")
 
     folder_value = full_path.replace("\\", "/")
-    CUSTOM_FOLDERS.add(folder_value)
+    folder_registry.add_custom(folder_value)
     return full_path, folder_value
 
 
-def has_png_files(folder_path: str) -> bool:
-    try:
-        with os.scandir(folder_path) as it:
-            for entry in it:
-                if entry.is_file() and entry.name.lower().endswith(".png"):
-                    return True
-    except OSError:
-        return False
-    return False
+def resolve_image_path(target_dir: str, filename: str) -> Tuple[str, str]:
+    relpath = filename.replace("\\", "/")
+    path = resolve_output_file(target_dir, relpath)
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="File not found")
+    return relpath, path
 
 
 def default_folder_label() -> str:
@@ -81,10 +123,11 @@ def label_for_folder(folder_path: str) -> str:
 
 
 def register_folder_item(
-    items: List[Dict[str, str]],
+    items: List[Dict[str, Any]],
     seen: Set[str],
     folder_path: str,
     label: Optional[str] = None,
+    stats: Optional["FolderStats"] = None,
 ) -> None:
     folder_abs = os.path.abspath(folder_path)
     output_abs = os.path.abspath(OUTPUT_DIR)
@@ -99,7 +142,152 @@ def register_folder_item(
         return
 
     seen.add(value_key)
-    items.append({"value": value, "label": label or label_for_folder(folder_abs)})
+    item: Dict[str, Any] = {"value": value, "label": label or label_for_folder(folder_abs)}
+    item.update((stats or folder_registry.stats(folder_abs)).summary())
+    items.append(item)
+
+
+@dataclass
+class FolderStats:
+    count: int
+    size: int
+    newest_mtime: float
+    # (path, st_mtime_ns) for every directory listed while counting; adding or
+    # removing a PNG changes the mtime of the directory that holds it.
+    dir_stamps: List[Tuple[str, int]] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, Any]:
+        return {"count": self.count, "size": self.size, "newest_mtime": self.newest_mtime}
+
+
+def _dir_mtime_ns(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class FolderRegistry:
+    """Per-directory PNG counts for /api/folders, revalidated by directory mtimes.
+
+    Custom folders and the cached stats are persisted so a restart neither
+    forgets opened folders nor rescans unchanged trees.
+    """
+
+    def __init__(self, state_path: str) -> None:
+        self.state_path = state_path
+        self.custom: Set[str] = set()
+        self._stats: Dict[str, FolderStats] = {}
+        self._children: Optional[Tuple[int, List[Tuple[str, str]]]] = None
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.custom = {str(path) for path in state.get("custom") or []}
+        for path, raw in (state.get("stats") or {}).items():
+            try:
+                self._stats[path] = FolderStats(
+                    count=int(raw["count"]),
+                    size=int(raw["size"]),
+                    newest_mtime=float(raw["newest_mtime"]),
+                    dir_stamps=[(str(p), int(m)) for p, m in raw["dir_stamps"]],
+                )
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        children = self.base_children()
+        with self._lock:
+            # Only keep stats for folders /api/folders can still list.
+            live = {os.path.normcase(os.path.abspath(OUTPUT_DIR))}
+            live.update(os.path.normcase(path) for _, path in children)
+            live.update(os.path.normcase(os.path.abspath(path)) for path in self.custom)
+            self._stats = {key: stats for key, stats in self._stats.items() if key in live}
+            state = {
+                "custom": sorted(self.custom),
+                "stats": {path: asdict(stats) for path, stats in self._stats.items()},
+            }
+            self._dirty = False
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_path)
+        except OSError as exc:
+            print(f"Error saving folder registry: {exc}")
+
+    def add_custom(self, folder_value: str) -> None:
+        with self._lock:
+            if folder_value in self.custom:
+                return
+            self.custom.add(folder_value)
+            self._dirty = True
+        self.save()
+
+    def custom_folders(self) -> List[str]:
+        with self._lock:
+            return sorted(self.custom)
+
+    def stats(self, folder_path: str) -> FolderStats:
+        key = os.path.normcase(os.path.abspath(folder_path))
+        with self._lock:
+            cached = self._stats.get(key)
+        if cached is not None and all(_dir_mtime_ns(path) == mtime for path, mtime in cached.dir_stamps):
+            return cached
+
+        visited: List[str] = []
+        count = 0
+        size = 0
+        newest = 0.0
+        for _, entry in iter_png_files(folder_path, visited_dirs=visited):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            count += 1
+            size += stat.st_size
+            newest = max(newest, stat.st_mtime)
+
+        stamps = [(path, mtime) for path in visited if (mtime := _dir_mtime_ns(path)) is not None]
+        stats = FolderStats(count=count, size=size, newest_mtime=newest, dir_stamps=stamps)
+        with self._lock:
+            self._stats[key] = stats
+            self._dirty = True
+        return stats
+
+    def base_children(self) -> List[Tuple[str, str]]:
+        """(name, path) of visible subdirectories of BASE_DIR, relisted only when it changes."""
+        base_mtime = _dir_mtime_ns(BASE_DIR)
+        with self._lock:
+            if self._children is not None and self._children[0] == base_mtime:
+                return self._children[1]
+
+        children: List[Tuple[str, str]] = []
+        try:
+            with os.scandir(BASE_DIR) as it:
+                for entry in it:
+                    if entry.name.startswith(".") or not entry.is_dir():
+                        continue
+                    children.append((entry.name, os.path.abspath(entry.path)))
+        except OSError:
+            pass
+
+        with self._lock:
+            self._children = (base_mtime or 0, children)
+        return children
+
+
+folder_registry = FolderRegistry(FOLDERS_STATE_PATH)
 
 # Helper function to read metadata (copied/simplified from app_fastapi.py)
 def read_png_metadata(png_path: str) -> Dict[str, Any]:
@@ -131,42 +319,547 @@ def read_png_metadata(png_path: str) -> Dict[str, Any]:
         print(f"Error reading metadata for {png_path}: {e}")
         return {}
 
+
+class _ZipStreamSink:
+    """Write-only file object that hands zip bytes to the response as they are produced."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        chunks, self._chunks = self._chunks, []
+        yield from chunks
+
+
+def image_matches_query(path: str, filename: str, query: str) -> bool:
+    needle = query.casefold()
+    if needle in filename.casefold():
+        return True
+    meta = read_png_metadata(path)
+    haystack = [meta.get("prompt")]
+    if meta.get("zimage"):
+        haystack.append(json.dumps(meta["zimage"], ensure_ascii=False))
+    return any(isinstance(text, str) and needle in text.casefold() for text in haystack)
+
+
+def collect_export_entries(
+    target_dir: str,
+    filenames: Optional[List[str]] = None,
+    query: Optional[str] = None,
+) -> List[Tuple[str, str]]:
+    candidates: List[Tuple[str, str]] = []
+    if filenames:
+        for name in dict.fromkeys(name.replace("\\", "/") for name in filenames if name):
+            path = resolve_output_file(target_dir, name)
+            if path is not None and os.path.isfile(path):
+                candidates.append((name, path))
+    else:
+        candidates = sorted((relpath, entry.path) for relpath, entry in iter_png_files(target_dir))
+
+    if not query:
+        return candidates
+    return [(name, path) for name, path in candidates if image_matches_query(path, name, query)]
+
+
+def iter_export_zip(entries: List[Tuple[str, str]], include_manifest: bool) -> Iterator[bytes]:
+    sink = _ZipStreamSink()
+    manifest: List[Dict[str, Any]] = []
+    # The sink cannot seek, so zipfile writes sizes/CRCs into data descriptors
+    # and nothing larger than one chunk is ever held in memory.
+    with zipfile.ZipFile(sink, mode="w", allowZip64=True) as zf:
+        for arcname, path in entries:
+            # Headers are already sent, so a bad entry must never abort the
+            # stream; strict_timestamps=False clamps pre-1980 mtimes.
+            try:
+                zinfo = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False)
+                src = open(path, "rb")
+            except (OSError, ValueError) as exc:
+                print(f"Skipping {arcname} in export: {exc}")
+                continue
+            complete = True
+            with src:
+                if arcname.lower().endswith(EXPORT_STORED_SUFFIXES):
+                    zinfo.compress_type = zipfile.ZIP_STORED
+                else:
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                with zf.open(zinfo, mode="w") as dst:
+                    while True:
+                        try:
+                            chunk = src.read(EXPORT_CHUNK_SIZE)
+                        except OSError as exc:
+                            # Part of the entry is already on the wire; close it
+                            # so the archive stays readable.
+                            print(f"Export of {arcname} truncated: {exc}")
+                            complete = False
+                            break
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        yield from sink.drain()
+            yield from sink.drain()
+
+            if include_manifest and complete:
+                meta = read_png_metadata(path)
+                manifest.append({"filename": arcname, "zimage": meta.get("zimage")})
+
+        if include_manifest:
+            zf.writestr(
+                "manifest.json",
+                json.dumps({"items": manifest}, ensure_ascii=False, indent=2),
+                compress_type=zipfile.ZIP_DEFLATED,
+            )
+    yield from sink.drain()
+
+
+def export_response(
+    folder: Optional[str],
+    filenames: Optional[List[str]],
+    query: Optional[str],
+    include_manifest: bool,
+) -> StreamingResponse:
+    target_dir, folder_value = resolve_folder_path(folder)
+    query = (query or "").strip() or None
+    entries = collect_export_entries(target_dir, filenames, query)
+    if not entries:
+        raise HTTPException(status_code=404, detail="No images to export")
+
+    if folder_value == DEFAULT_FOLDER_KEY:
+        folder_name = os.path.basename(os.path.abspath(OUTPUT_DIR))
+    else:
+        folder_name = os.path.basename(target_dir.rstrip("/\\"))
+    archive_name = f"{folder_name or 'images'}_{time.strftime('%Y%m%d_%H%M%S')}.zip"
+    headers = {"Content-Disposition": f"attachment; filename*=UTF-8''{quote(archive_name, safe='')}"}
+    return StreamingResponse(
+        iter_export_zip(entries, include_manifest),
+        media_type="application/zip",
+        headers=headers,
+    )
+
+
+def _env_size(name: str) -> Optional[int]:
+    raw = (os.getenv(name) or "").strip().upper().removesuffix("B")
+    if not raw:
+        return None
+    multiplier = 1
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if raw[-1] in units:
+        multiplier = units[raw[-1]]
+        raw = raw[:-1]
+    try:
+        return int(float(raw) * multiplier)
+    except ValueError:
+        return None
+
+
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    raw = (os.getenv(name) or "").strip()
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        return default
+
+
+def _lower_thread_priority() -> None:
+    # On Linux niceness is per thread, so this only deprioritises the collector.
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+
+@dataclass
+class RetentionPolicy:
+    max_bytes: Optional[int] = None
+    max_age_days: Optional[float] = None
+    keep_starred: bool = True
+    action: str = "delete"
+    archive_dir: str = ""
+    interval_sec: float = 3600.0
+    batch_size: int = 200
+    batch_pause_sec: float = 1.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes is not None or self.max_age_days is not None
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        keep_starred = (os.getenv("WINDDRAWER_RETENTION_KEEP_STARRED") or "1").strip().lower()
+        policy = cls(
+            max_bytes=_env_size("WINDDRAWER_RETENTION_MAX_BYTES"),
+            max_age_days=_env_float("WINDDRAWER_RETENTION_MAX_AGE_DAYS", None),
+            keep_starred=keep_starred not in ("0", "false", "no", "off"),
+            action=(os.getenv("WINDDRAWER_RETENTION_ACTION") or "delete").strip().lower(),
+            archive_dir=(os.getenv("WINDDRAWER_RETENTION_ARCHIVE_DIR") or "").strip(),
+            interval_sec=_env_float("WINDDRAWER_RETENTION_INTERVAL_SEC", 3600.0) or 3600.0,
+            batch_size=int(_env_float("WINDDRAWER_RETENTION_BATCH_SIZE", 200) or 200),
+            batch_pause_sec=_env_float("WINDDRAWER_RETENTION_BATCH_PAUSE_SEC", 1.0) or 0.0,
+        )
+        try:
+            policy.validate()
+        except ValueError as exc:
+            # Never guess where files should go: an unusable env policy disables retention.
+            print(f"Ignoring invalid retention settings, retention disabled: {exc}")
+            return cls()
+        return policy
+
+    def update(self, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply ``changes`` and validate; returns the normalised changes."""
+        applied: Dict[str, Any] = {}
+        for key, value in changes.items():
+            if key not in self.__dataclass_fields__:
+                raise ValueError(f"unknown policy field: {key}")
+            if key in ("max_bytes", "batch_size"):
+                value = None if value is None else int(value)
+            elif key in ("max_age_days", "interval_sec", "batch_pause_sec"):
+                value = None if value is None else float(value)
+            elif key == "keep_starred":
+                if not isinstance(value, bool):
+                    raise ValueError("keep_starred must be true or false")
+            elif key == "action":
+                if value not in RETENTION_ACTIONS:
+                    raise ValueError(f"action must be one of {', '.join(RETENTION_ACTIONS)}")
+            elif key == "archive_dir":
+                if not isinstance(value, str) or not value.strip():
+                    raise ValueError("archive_dir must be a non-empty path")
+                value = value.strip()
+            setattr(self, key, value)
+            applied[key] = value
+        self.validate()
+        return applied
+
+    def validate(self) -> None:
+        # A zero or negative limit would select every unstarred file.
+        if self.max_bytes is not None and self.max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1")
+        if self.max_age_days is not None and self.max_age_days <= 0:
+            raise ValueError("max_age_days must be positive")
+        if self.action not in RETENTION_ACTIONS:
+            raise ValueError(f"action must be one of {', '.join(RETENTION_ACTIONS)}")
+        if self.action == "archive" and not os.path.isabs(self.archive_dir or ""):
+            raise ValueError("action 'archive' requires an absolute archive_dir")
+        if self.interval_sec is None or self.interval_sec < 60:
+            raise ValueError("interval_sec must be at least 60")
+        if self.batch_size is None or self.batch_size < 1:
+            raise ValueError("batch_size must be positive")
+        if self.batch_pause_sec is None:
+            self.batch_pause_sec = 0.0
+
+
+class OutputRetention:
+    """Tracks views/stars for OUTPUT_DIR and trims it according to RetentionPolicy."""
+
+    def __init__(self, output_dir: str, state_path: str) -> None:
+        self.output_dir = output_dir
+        self.state_path = state_path
+        self.policy = RetentionPolicy.from_env()
+        # Only fields set through PUT /api/retention/policy are persisted, so
+        # WINDDRAWER_RETENTION_* changes still apply on the next start.
+        self.policy_overrides: Dict[str, Any] = {}
+        self.views: Dict[str, float] = {}
+        self.starred: Set[str] = set()
+        # Changes whenever the starred set does; part of the /api/images ETag.
+        self.star_token = f"{time.time_ns():x}"
+        self.last_report: Optional[Dict[str, Any]] = None
+        self.totals = {"runs": 0, "removed_files": 0, "reclaimed_bytes": 0, "archived_bytes": 0}
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._dirty = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.views = {str(k): float(v) for k, v in (state.get("views") or {}).items()}
+        self.starred = {str(name) for name in state.get("starred") or []}
+        self.last_report = state.get("last_report")
+        self.totals.update(state.get("totals") or {})
+        overrides = state.get("policy_overrides") or {}
+        try:
+            candidate = RetentionPolicy(**asdict(self.policy))
+            self.policy_overrides = candidate.update(overrides)
+            self.policy = candidate
+        except (TypeError, ValueError) as exc:
+            print(f"Ignoring invalid stored retention policy overrides: {exc}")
+
+    def save(self) -> None:
+        with self._lock:
+            state = {
+                "policy_overrides": dict(self.policy_overrides),
+                "views": dict(self.views),
+                "starred": sorted(self.starred),
+                "last_report": self.last_report,
+                "totals": dict(self.totals),
+            }
+            self._dirty = False
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_path)
+        except OSError as exc:
+            print(f"Error saving retention state: {exc}")
+
+    def record_view(self, filename: str) -> None:
+        with self._lock:
+            self.views[filename] = time.time()
+            self._dirty = True
+
+    def set_starred(self, filename: str, starred: bool) -> None:
+        with self._lock:
+            if starred:
+                self.starred.add(filename)
+            else:
+                self.starred.discard(filename)
+            self.star_token = f"{time.time_ns():x}"
+        self.save()
+
+    def is_starred(self, filename: str) -> bool:
+        with self._lock:
+            return filename in self.starred
+
+    def update_policy(self, changes: Dict[str, Any]) -> RetentionPolicy:
+        with self._lock:
+            candidate = RetentionPolicy(**asdict(self.policy))
+            applied = candidate.update(changes)
+            self.policy = candidate
+            self.policy_overrides.update(applied)
+        self.save()
+        self._wake.set()
+        return candidate
+
+    def plan(self) -> Tuple[int, List[Tuple[str, int]]]:
+        """Return (total_bytes, [(filename, size)]) to remove, least recently viewed first."""
+        now = time.time()
+        files: List[Tuple[str, int, float]] = []
+        total = 0
+        for relpath, entry in iter_png_files(self.output_dir):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            total += stat.st_size
+            files.append((relpath, stat.st_size, stat.st_mtime))
+
+        with self._lock:
+            policy = self.policy
+            views = dict(self.views)
+            starred = set(self.starred)
+        if not policy.enabled:
+            return total, []
+
+        candidates: List[Tuple[float, str, int]] = []
+        for name, size, mtime in files:
+            # Leave fresh files alone: the drawer rewrites PNGs right after rendering.
+            if now - mtime < RETENTION_GRACE_SEC:
+                continue
+            if policy.keep_starred and name in starred:
+                continue
+            candidates.append((max(mtime, views.get(name, 0.0)), name, size))
+        candidates.sort()
+
+        max_age_sec = policy.max_age_days * 86400 if policy.max_age_days is not None else None
+        remaining = total
+        selected: List[Tuple[str, int]] = []
+        for last_used, name, size in candidates:
+            expired = max_age_sec is not None and now - last_used > max_age_sec
+            over_quota = policy.max_bytes is not None and remaining > policy.max_bytes
+            if not (expired or over_quota):
+                # Candidates are ordered by last use, so nothing after this qualifies either.
+                break
+            selected.append((name, size))
+            remaining -= size
+        return total, selected
+
+    def _remove(self, filename: str, policy: RetentionPolicy) -> None:
+        path = to_abs_path(self.output_dir, filename)
+        if policy.action == "archive":
+            archive_path = to_abs_path(policy.archive_dir, filename)
+            os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+            shutil.move(path, archive_path)
+        else:
+            os.remove(path)
+
+    def _new_report(self, dry_run: bool) -> Tuple[Dict[str, Any], RetentionPolicy, List[Tuple[str, int]]]:
+        started = time.time()
+        total_before, selected = self.plan()
+        with self._lock:
+            policy = RetentionPolicy(**asdict(self.policy))
+        report: Dict[str, Any] = {
+            "started_at": started,
+            "dry_run": dry_run,
+            "action": policy.action,
+            "total_bytes_before": total_before,
+            "candidates": len(selected),
+            "candidate_bytes": sum(size for _, size in selected),
+            "removed_files": 0,
+            "reclaimed_bytes": 0,
+            "archived_bytes": 0,
+            "errors": 0,
+        }
+        return report, policy, selected
+
+    def preview(self) -> Dict[str, Any]:
+        report, _, selected = self._new_report(dry_run=True)
+        report["files"] = [name for name, _ in selected]
+        report["finished_at"] = time.time()
+        return report
+
+    def run_once(self) -> Dict[str, Any]:
+        with self._run_lock:
+            report, policy, selected = self._new_report(dry_run=False)
+            total_before = report["total_bytes_before"]
+            for start in range(0, len(selected), policy.batch_size):
+                if self._stop.is_set():
+                    break
+                for name, size in selected[start:start + policy.batch_size]:
+                    # A file may have been starred since the plan was made.
+                    if policy.keep_starred and self.is_starred(name):
+                        continue
+                    try:
+                        self._remove(name, policy)
+                    except OSError as exc:
+                        print(f"Retention failed to remove {name}: {exc}")
+                        report["errors"] += 1
+                        continue
+                    with self._lock:
+                        self.views.pop(name, None)
+                    report["removed_files"] += 1
+                    # Archived files still occupy disk somewhere; only deletes free space.
+                    if policy.action == "archive":
+                        report["archived_bytes"] += size
+                    else:
+                        report["reclaimed_bytes"] += size
+                bump_generation(self.output_dir)
+                if start + policy.batch_size < len(selected):
+                    self._stop.wait(policy.batch_pause_sec)
+
+            report["total_bytes_after"] = total_before - report["reclaimed_bytes"] - report["archived_bytes"]
+            report["finished_at"] = time.time()
+            with self._lock:
+                self.last_report = report
+                self.totals["runs"] += 1
+                self.totals["removed_files"] += report["removed_files"]
+                self.totals["reclaimed_bytes"] += report["reclaimed_bytes"]
+                self.totals["archived_bytes"] += report["archived_bytes"]
+            self.save()
+            return report
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "policy": asdict(self.policy),
+                "policy_overrides": dict(self.policy_overrides),
+                "enabled": self.policy.enabled,
+                "running": self._run_lock.locked(),
+                "starred": len(self.starred),
+                "last_report": self.last_report,
+                "totals": dict(self.totals),
+            }
+
+    def _loop(self) -> None:
+        _lower_thread_priority()
+        while not self._stop.is_set():
+            if self.policy.enabled:
+                try:
+                    self.run_once()
+                except Exception as exc:
+                    print(f"Retention run failed: {exc}")
+            elif self._dirty:
+                self.save()
+            self._wake.wait(self.policy.interval_sec)
+            self._wake.clear()
+
+    def trigger(self) -> None:
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="output-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._dirty:
+            self.save()
+
+
+retention = OutputRetention(OUTPUT_DIR, RETENTION_STATE_PATH)
+
+_similarity_indexes: Dict[str, SimilarityIndex] = {}
+_similarity_lock = threading.Lock()
+
+
+def refresh_similarity_index(target_dir: str) -> Optional[SimilarityIndex]:
+    """Get the folder's hash index, re-indexing in the background if the folder changed."""
+    if not SIMILARITY_INDEX_ENABLED:
+        return None
+    key = cache_key(target_dir)
+    with _similarity_lock:
+        index = _similarity_indexes.get(key)
+        if index is None:
+            index = SimilarityIndex(target_dir, os.path.join(HASH_CACHE_DIR, f"{key}.npz"))
+            _similarity_indexes[key] = index
+    index.refresh(folder_generation(target_dir))
+    return index
+
 # Mount static files
 app.mount("/static", StaticFiles(directory=os.path.join(WEB_DIR, "static")), name="static")
-app.mount("/outputs", StaticFiles(directory=OUTPUT_DIR), name="outputs")
+app.mount("/outputs", ImmutableStaticFiles(directory=OUTPUT_DIR), name="outputs")
+
+_viewer_page = CachedFile(os.path.join(WEB_DIR, "viewer.html"))
 
 @app.get("/", response_class=HTMLResponse)
-def index():
+def index(request: Request):
     # We will serve the viewer.html here
-    viewer_path = os.path.join(WEB_DIR, "viewer.html")
-    if os.path.exists(viewer_path):
-        with open(viewer_path, "r", encoding="utf-8") as f:
-            return f.read()
-    return "viewer.html not found"
+    return _viewer_page.response(request, missing="viewer.html not found")
+
+
+@app.get("/api/ready")
+def api_ready():
+    # Cheap health probe for launchers; /api/images walks the whole folder.
+    return {"ready": True}
 
 
 @app.get("/api/folders")
 def api_folders():
-    items = [{"value": DEFAULT_FOLDER_KEY, "label": default_folder_label()}]
+    default_item: Dict[str, Any] = {"value": DEFAULT_FOLDER_KEY, "label": default_folder_label()}
+    default_item.update(folder_registry.stats(OUTPUT_DIR).summary())
+    items = [default_item]
     seen: Set[str] = {os.path.normcase(os.path.abspath(OUTPUT_DIR).replace("\\", "/"))}
 
-    try:
-        with os.scandir(BASE_DIR) as it:
-            for entry in it:
-                if not entry.is_dir():
-                    continue
-                if entry.name.startswith("."):
-                    continue
-
-                folder_abs = os.path.abspath(entry.path)
-                if entry.name in PINNED_FOLDERS or has_png_files(entry.path):
-                    register_folder_item(items, seen, folder_abs, entry.name.replace("\\", "/"))
-    except OSError:
-        pass
+    for name, folder_abs in folder_registry.base_children():
+        stats = folder_registry.stats(folder_abs)
+        if name in PINNED_FOLDERS or stats.count > 0:
+            register_folder_item(items, seen, folder_abs, name.replace("\\", "/"), stats)
 
-    for folder_path in sorted(CUSTOM_FOLDERS):
+    for folder_path in folder_registry.custom_folders():
         register_folder_item(items, seen, folder_path)
 
+    folder_registry.save()
     fixed = items[:1]
     others = sorted(items[1:], key=lambda x: x["label"].lower())
     return {"current": DEFAULT_FOLDER_KEY, "items": fixed + others}
@@ -191,55 +884,164 @@ def api_open_folder(payload: Optional[Dict[str, str]] = Body(default=None)):
 
 
 @app.get("/api/images")
-def api_images(folder: Optional[str] = Query(default=DEFAULT_FOLDER_KEY)):
+def api_images(request: Request, folder: Optional[str] = Query(default=DEFAULT_FOLDER_KEY)):
     target_dir, folder_value = resolve_folder_path(folder)
+    refresh_similarity_index(target_dir)
+    # Stars only change the listing, not the PNG set, so they get their own
+    # token instead of bumping the folder generation (which would re-index).
+    star_token = retention.star_token if folder_value == DEFAULT_FOLDER_KEY else ""
+    etag = make_etag("images", folder_value, folder_generation(target_dir), star_token)
+    return cached_json_response(request, etag, lambda: list_images(target_dir, folder_value))
+
+
+def list_images(target_dir: str, folder_value: str) -> Dict[str, Any]:
     items: List[dict] = []
-    try:
-        for name in os.listdir(target_dir):
-            if not name.lower().endswith(".png"):
-                continue
-            path = os.path.join(target_dir, name)
-            try:
-                stat = os.stat(path)
-                image_url = f"/api/image/{quote(name, safe='')}?folder={quote(folder_value, safe='')}"
-                items.append({
-                    "filename": name,
-                    "folder": folder_value,
-                    "url": image_url,
-                    "mtime": stat.st_mtime,
-                    "size": stat.st_size
-                })
-            except OSError:
-                continue
-    except OSError:
-        pass
-    
+    for name, entry in iter_png_files(target_dir):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        image_url = f"/api/image/{quote(name, safe='/')}?folder={quote(folder_value, safe='')}"
+        items.append({
+            "filename": name,
+            "folder": folder_value,
+            "url": image_url,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "starred": folder_value == DEFAULT_FOLDER_KEY and retention.is_starred(name),
+        })
+
     # Sort by modification time descending (newest first)
     items.sort(key=lambda x: x.get("mtime", 0), reverse=True)
     return {"folder": folder_value, "items": items}
 
 
-@app.get("/api/image/{filename}")
-def api_image(filename: str, folder: Optional[str] = Query(default=DEFAULT_FOLDER_KEY)):
-    target_dir, _ = resolve_folder_path(folder)
-    safe_name = os.path.basename(filename)
-    path = os.path.join(target_dir, safe_name)
-    if not os.path.isfile(path):
-        raise HTTPException(status_code=404, detail="File not found")
+@app.get("/api/image/{filename:path}")
+def api_image(
+    request: Request,
+    filename: str,
+    folder: Optional[str] = Query(default=DEFAULT_FOLDER_KEY),
+    thumb: bool = Query(default=False),
+):
+    target_dir, folder_value = resolve_folder_path(folder)
+    safe_name, path = resolve_image_path(target_dir, filename)
 
-    return FileResponse(path)
+    # Gallery thumbnails load every card, so only full-size opens count as views.
+    # Those keep revalidating (cheap 304s) so retention still sees every view.
+    if folder_value == DEFAULT_FOLDER_KEY and not thumb:
+        retention.record_view(safe_name)
+    return file_response(request, path, immutable=folder_value == DEFAULT_FOLDER_KEY and thumb)
 
-@app.get("/api/metadata/{filename}")
+@app.get("/api/metadata/{filename:path}")
 def api_metadata(filename: str, folder: Optional[str] = Query(default=DEFAULT_FOLDER_KEY)):
     target_dir, _ = resolve_folder_path(folder)
-    safe_name = os.path.basename(filename)
-    path = os.path.join(target_dir, safe_name)
-    if not os.path.exists(path):
-        raise HTTPException(status_code=404, detail="File not found")
+    safe_name, path = resolve_image_path(target_dir, filename)
     
     meta = read_png_metadata(path)
     return {"filename": safe_name, "metadata": meta}
 
+
+@app.get("/api/export")
+def api_export(
+    folder: Optional[str] = Query(default=DEFAULT_FOLDER_KEY),
+    files: Optional[List[str]] = Query(default=None),
+    q: Optional[str] = Query(default=None),
+    manifest: bool = Query(default=False),
+):
+    return export_response(folder, files, q, manifest)
+
+
+@app.post("/api/export")
+def api_export_selection(payload: Optional[Dict[str, Any]] = Body(default=None)):
+    payload = payload or {}
+    files = payload.get("files")
+    if files is not None and not isinstance(files, list):
+        raise HTTPException(status_code=400, detail="files must be a list")
+    return export_response(
+        payload.get("folder"),
+        [str(name) for name in files] if files else None,
+        payload.get("q"),
+        bool(payload.get("manifest")),
+    )
+
+
+@app.get("/api/similar")
+def api_similar(
+    folder: Optional[str] = Query(default=DEFAULT_FOLDER_KEY),
+    filename: Optional[str] = Query(default=None),
+    max_distance: Optional[int] = Query(default=None, ge=0, le=64),
+    limit: int = Query(default=50, ge=1, le=1000),
+    hash_kind: str = Query(default="phash", alias="hash", pattern="^(phash|dhash)$"),
+):
+    target_dir, folder_value = resolve_folder_path(folder)
+    index = refresh_similarity_index(target_dir)
+    if index is None:
+        raise HTTPException(status_code=503, detail="Similarity index is disabled")
+
+    result: Dict[str, Any] = {"folder": folder_value, "hash": hash_kind}
+    result.update(index.status())
+    if not filename:
+        # Clusters are precomputed by the index thread up to CLUSTER_MAX_DISTANCE.
+        if max_distance is None:
+            max_distance = CLUSTER_MAX_DISTANCE
+        if max_distance > CLUSTER_MAX_DISTANCE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"max_distance must be at most {CLUSTER_MAX_DISTANCE} without filename",
+            )
+        clusters = index.clusters(max_distance, kind=hash_kind)
+        result["max_distance"] = max_distance
+        result["clusters"] = clusters or []
+        result["pending_clusters"] = clusters is None
+        return result
+
+    if max_distance is None:
+        max_distance = SIMILAR_MAX_DISTANCE
+    result["max_distance"] = max_distance
+
+    relpath, _ = resolve_image_path(target_dir, filename)
+    items = index.similar(relpath, max_distance, limit, kind=hash_kind)
+    result["filename"] = relpath
+    # None means the file exists but its hash is still being computed.
+    result["items"] = items or []
+    result["pending_file"] = items is None
+    return result
+
+
+@app.post("/api/star/{filename:path}")
+def api_star(filename: str, payload: Optional[Dict[str, Any]] = Body(default=None)):
+    safe_name, _ = resolve_image_path(OUTPUT_DIR, filename)
+
+    starred = bool((payload or {}).get("starred", True))
+    retention.set_starred(safe_name, starred)
+    return {"filename": safe_name, "starred": starred}
+
+
+@app.get("/api/retention")
+def api_retention():
+    return retention.status()
+
+
+@app.put("/api/retention/policy")
+def api_retention_policy(payload: Optional[Dict[str, Any]] = Body(default=None)):
+    try:
+        policy = retention.update_policy(payload or {})
+    except (TypeError, ValueError) as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {"policy": asdict(policy), "enabled": policy.enabled}
+
+
+@app.post("/api/retention/run")
+def api_retention_run(payload: Optional[Dict[str, Any]] = Body(default=None)):
+    if (payload or {}).get("dry_run"):
+        return retention.preview()
+
+    if not retention.policy.enabled:
+        raise HTTPException(status_code=409, detail="Retention policy is disabled")
+    retention.trigger()
+    return {"status": "scheduled", **retention.status()}
+
+
 if __name__ == "__main__":
     # Use a different port than the main app (8000)
     uvicorn.run(app, host="127.0.0.1", port=8001)
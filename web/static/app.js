@@ -56,7 +56,7 @@ function addImageCard(item) {
 
   const dl = document.createElement('a');
   dl.href = item.url;
-  dl.download = item.filename;
+  dl.download = item.filename.split('/').pop();
   dl.textContent = 'Download / 下载';
 
   actions.appendChild(open);
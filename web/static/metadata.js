@@ -20,7 +20,7 @@ function setPreview(filename, url) {
   el('openLink').href = url;
   const dl = el('downloadLink');
   dl.href = url;
-  dl.download = filename;
+  dl.download = filename.split('/').pop();
 }
 
 async function loadMetadata(filename) {